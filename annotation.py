@@ -22,6 +22,183 @@ def italics(string):
     return FontFormat.ITALIC_START + string + FontFormat.ITALIC_END
 
 
+# A worker is considered skewed if it processes this many times the average number of rows
+WORKER_SKEW_RATIO = 2.0
+
+
+# Function to prefix the node type with "Parallel" if the node is executed by parallel workers
+def nodeName(query_plan):
+    if query_plan.get("Parallel Aware"):
+        return "Parallel " + query_plan["Node Type"]
+    return query_plan["Node Type"]
+
+
+# Function to obtain the rows and time of each parallel worker, including the leader, from ANALYZE output
+def workerStats(query_plan):
+    workers = [
+        {
+            "name": f"worker {worker['Worker Number']}",
+            "rows": worker["Actual Rows"] * worker.get("Actual Loops", 1),
+            "time": worker["Actual Total Time"],
+        }
+        for worker in query_plan.get("Workers", [])
+        if "Actual Rows" in worker
+    ]
+    if not workers:
+        return []
+
+    # The rows of the node are averaged over the loops of all processes, so the leader
+    # processed whatever is left after subtracting the rows of the workers
+    total_rows = query_plan["Actual Rows"] * query_plan["Actual Loops"]
+    leader_rows = total_rows - sum(worker["rows"] for worker in workers)
+    if leader_rows > 0:
+        workers.append({"name": "leader", "rows": leader_rows, "time": None})
+    return workers
+
+
+# Function to obtain the ratio between the busiest worker and the average worker
+def workerSkew(workers):
+    if len(workers) < 2:
+        return 1.0
+    average_rows = sum(worker["rows"] for worker in workers) / len(workers)
+    if not average_rows:
+        return 1.0
+    return max(worker["rows"] for worker in workers) / average_rows
+
+
+# Workers Planned and Workers Launched of Gather and Gather Merge
+def workersPlannedAnnotation(query_plan):
+    planned = query_plan.get("Workers Planned", 0)
+    result = f" by {bold(str(planned))} planned worker(s)"
+
+    # Workers Launched is only available in ANALYZE mode
+    if "Workers Launched" in query_plan:
+        launched = query_plan["Workers Launched"]
+        result += f", of which {bold(str(launched))} were launched"
+        if launched < planned:
+            result += ". Fewer workers were launched than planned, so the leader process had to do more of the work itself"
+
+    result += "."
+    return result
+
+
+# Rows and time of each parallel worker in ANALYZE mode
+def workersAnnotation(query_plan):
+    workers = workerStats(query_plan)
+    if not workers:
+        return ""
+
+    result = " The work was split between " + ", ".join(
+        f"{worker['name']} ({bold(str(int(worker['rows'])))} rows"
+        + (f" in {worker['time']:.2f} ms)" if worker["time"] is not None else ")")
+        for worker in workers
+    )
+    result += "."
+
+    skew = workerSkew(workers)
+    if skew >= WORKER_SKEW_RATIO:
+        result += f" The busiest process handled {bold(f'{skew:.1f}x')} the average number of rows, so the workers are skewed."
+    return result
+
+
+# Sorts need more memory than the space they use on disk because of the per-tuple overhead in memory,
+# so this is a rough estimate of the memory an external sort would need to run in memory instead
+SORT_DISK_TO_MEMORY_RATIO = 2.0
+
+
+# Function to format an amount of kilobytes, as reported by ANALYZE, for display
+def formatKilobytes(kilobytes):
+    if kilobytes >= 1024 * 1024:
+        return f"{kilobytes / 1024 / 1024:.1f} GB"
+    if kilobytes >= 1024:
+        return f"{kilobytes / 1024:.1f} MB"
+    return f"{int(kilobytes)} kB"
+
+
+# Function to obtain the memory and disk usage of a Sort, Hash or HashAggregate node from ANALYZE output.
+# The work_mem that would avoid a spill is only estimated from the memory and disk usage.
+# Hash tables may use work_mem * hash_mem_multiplier, so the work_mem they need is scaled down accordingly.
+# A sort only spills once it has filled work_mem, so work_mem is used as the memory of a spilled sort.
+def memoryUsage(query_plan, hash_mem_multiplier=1.0, work_mem_kb=0):
+    usages = []
+
+    # Every parallel worker sorts and aggregates its own share of the rows with its own work_mem
+    for plan in [query_plan] + query_plan.get("Workers", []):
+
+        # Sort
+        if "Sort Space Used" in plan:
+            used = plan["Sort Space Used"]
+            spilled = plan.get("Sort Space Type") == "Disk"
+            usages.append(
+                {
+                    "memory_kb": work_mem_kb if spilled else used,
+                    "disk_kb": used if spilled else 0,
+                    "spilled": spilled,
+                    "work_mem_kb": used * SORT_DISK_TO_MEMORY_RATIO
+                    if spilled
+                    else used,
+                }
+            )
+
+        # Hash, where each batch after the first is written to disk
+        elif "Hash Batches" in plan:
+            batches = plan["Hash Batches"]
+            peak = plan.get("Peak Memory Usage", 0)
+            usages.append(
+                {
+                    "memory_kb": peak,
+                    "disk_kb": 0,
+                    "spilled": batches > 1,
+                    "work_mem_kb": peak * batches / hash_mem_multiplier,
+                }
+            )
+
+        # HashAggregate
+        elif "HashAgg Batches" in plan:
+            peak = plan.get("Peak Memory Usage", 0)
+            disk = plan.get("Disk Usage", 0)
+            usages.append(
+                {
+                    "memory_kb": peak,
+                    "disk_kb": disk,
+                    "spilled": plan["HashAgg Batches"] > 1 or disk > 0,
+                    "work_mem_kb": (peak + disk) / hash_mem_multiplier,
+                }
+            )
+
+    if not usages:
+        return None
+
+    return {
+        "memory_kb": max(usage["memory_kb"] for usage in usages),
+        "disk_kb": max(usage["disk_kb"] for usage in usages),
+        "spilled": any(usage["spilled"] for usage in usages),
+        "work_mem_kb": max(usage["work_mem_kb"] for usage in usages),
+    }
+
+
+# Memory usage and spills of Sort, Hash and Aggregate nodes in ANALYZE mode
+def memoryAnnotation(query_plan, hash_mem_multiplier=1.0, work_mem_kb=0):
+    usage = memoryUsage(query_plan, hash_mem_multiplier, work_mem_kb)
+    if usage is None:
+        return ""
+
+    if usage["spilled"]:
+        result = f" The operation {bold('spilled to disk')}"
+        if usage["disk_kb"]:
+            result += f", writing {bold(formatKilobytes(usage['disk_kb']))} of temporary files"
+        if usage["memory_kb"]:
+            result += f" after using {bold(formatKilobytes(usage['memory_kb']))} of memory"
+        result += (
+            f". It needs an estimated {bold('work_mem')} of roughly {bold(formatKilobytes(usage['work_mem_kb']))} "
+            f"to stay in memory, so raising {bold('work_mem')} to this value may not always avoid the spill."
+        )
+    else:
+        result = f" The operation fits in memory, using {bold(formatKilobytes(usage['memory_kb']))}."
+
+    return result
+
+
 # Default Annotation if none of the node types are identified in the annotation functions listed below
 def defaultAnnotation(query_plan):
     return f"The {italics(query_plan['Node Type'])} operation is performed."
@@ -69,12 +246,25 @@ def uniqueAnnotation(query_plan):
 
 # Hash
 def hashAnnotation(query_plan):
+    if query_plan.get("Parallel Aware"):
+        return f"The {italics(nodeName(query_plan))} function hashes the query rows into a hash table in shared memory, which is built and used by all parallel workers of its parent operation."
     return f"The {italics(query_plan['Node Type'])} function hashes the query rows into memory, for use by its parent operation."
 
 
+# Gather
+def gatherAnnotation(query_plan):
+    return (
+        f"The {italics(query_plan['Node Type'])} operation combines the output of sub-operations that are executed in parallel"
+        + workersPlannedAnnotation(query_plan)
+    )
+
+
 # Gather Merge
 def gatherMergeAnnotation(query_plan):
-    return f"The {italics(query_plan['Node Type'])} operation combines the output table from sub-operations by executing the operation in parallel."
+    return (
+        f"The {italics(query_plan['Node Type'])} operation combines the output table from sub-operations by executing the operation in parallel, while preserving their sort order"
+        + workersPlannedAnnotation(query_plan)
+    )
 
 
 # Aggregate
@@ -244,7 +434,7 @@ def SetOpAnnotation(query_plan):
 
 # Sequential Scan
 def sequentialScanAnnotation(query_plan):
-    result = f"The {italics(query_plan['Node Type'])} operation performs a scan on relation "
+    result = f"The {italics(nodeName(query_plan))} operation performs a scan on relation "
 
     # Get the relation name from query plan
     if "Relation Name" in query_plan:
@@ -332,6 +522,7 @@ class Annotation(object):
         "Sort": sortAnnotation,
         "Hash": hashAnnotation,
         "Hash Join": hashJoinAnnotation,
+        "Gather": gatherAnnotation,
         "Gather Merge": gatherMergeAnnotation,
     }
 
@@ -0,0 +1,135 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# Plans with more nodes than this are only shown through the plan explorer,
+# instead of rendering the full explanation and graph into the page
+FULL_PLAN_MAX_NODES = int(os.getenv("FULL_PLAN_MAX_NODES", 50))
+
+# Maximum number of per-node recommendations or diagnostics rendered into the page,
+# the remaining ones are only shown on their nodes in the plan explorer
+MAX_PAGE_ITEMS = int(os.getenv("MAX_PAGE_ITEMS", 10))
+
+
+def is_small_plan(plan) -> bool:
+    """Check whether the full explanation and graph of a plan can be rendered into the page.
+
+    Args:
+        plan (QueryPlan): The QEP.
+
+    Returns:
+        bool: Whether the plan is small enough.
+    """
+    return len(plan.nodes) <= FULL_PLAN_MAX_NODES
+
+
+def page_items(items) -> list:
+    """Caps a list of per-node recommendations or diagnostics rendered into the page,
+    so that its size does not grow with the number of nodes in the plan.
+
+    Args:
+        items (list): Recommendations or diagnostics of the plan.
+
+    Returns:
+        list: At most MAX_PAGE_ITEMS of the items, followed by a note on the rest.
+    """
+    if len(items) <= MAX_PAGE_ITEMS:
+        return items
+    return items[:MAX_PAGE_ITEMS] + [
+        f"... and {len(items) - MAX_PAGE_ITEMS} more, shown on their nodes in the plan explorer."
+    ]
+
+
+def node_summary(plan, node) -> dict:
+    """Summarises a single node and the rollup of its subtree for the plan explorer.
+
+    Args:
+        plan (QueryPlan): The QEP the node belongs to.
+        node (Node): The node.
+
+    Returns:
+        dict: Summary of the node which can be serialised to JSON.
+    """
+    return {
+        "id": node.node_id,
+        "node_type": node.node_type,
+        "relation_name": getattr(node, "relation_name", None),
+        "total_cost": node.total_cost,
+        "self_cost": node.self_cost,
+        "plan_rows": node.plan_rows,
+        "explanation": node.explanation,
+        "diagnostics": node.diagnostics,
+        "num_children": len(plan.graph[node]),
+        "rollup": {
+            "cost": node.subtree_cost,
+            "rows": node.subtree_rows,
+            "num_nodes": node.subtree_num_nodes,
+            "node_types": node.subtree_node_types,
+        },
+    }
+
+
+def subtree_response(plan, node) -> dict:
+    """Summarises a node along with its direct child nodes, which is all the plan
+    explorer needs to expand the node.
+
+    Args:
+        plan (QueryPlan): The QEP the node belongs to.
+        node (Node): The node being expanded.
+
+    Returns:
+        dict: Summary of the node and of each of its child nodes.
+    """
+    return {
+        "node": node_summary(plan, node),
+        "children": [node_summary(plan, child) for child in plan.graph[node]],
+    }
+
+
+class PlanStore:
+    def __init__(self, max_plans):
+        """Initialises an in-memory store of recently explained plans, from which the
+        plan explorer fetches subtrees on demand.
+        The least recently used plan is evicted once the store is full.
+
+        Args:
+            max_plans (int): Maximum number of plans kept in memory.
+        """
+        self.max_plans = max_plans
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, plan) -> str:
+        """Stores a plan.
+
+        Args:
+            plan (QueryPlan): The QEP.
+
+        Returns:
+            str: Id of the plan, used in the URLs of the plan explorer.
+        """
+        plan_id = uuid.uuid4().hex
+        with self.lock:
+            self.plans[plan_id] = plan
+            while len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+        return plan_id
+
+    def get(self, plan_id):
+        """Retrieves a stored plan.
+
+        Args:
+            plan_id (str): Id returned by add.
+
+        Returns:
+            QueryPlan: The QEP, or None if it is unknown or has been evicted.
+        """
+        with self.lock:
+            plan = self.plans.get(plan_id)
+            if plan is not None:
+                self.plans.move_to_end(plan_id)
+            return plan
+
+
+plan_store = PlanStore(int(os.getenv("PLAN_STORE_SIZE", 50)))
@@ -1,3 +1,4 @@
+import math
 import os
 import time
 
@@ -5,10 +6,40 @@ import matplotlib.pyplot as plt
 import networkx as nx
 from config.base import project_root
 from annotation import *
+from explorer import is_small_plan
+
+# Relations of the TPC-H dataset which are large enough to benefit from a parallel scan
+LARGE_RELATIONS = ("lineitem", "orders")
+
+# Settings which control whether PostgreSQL chooses a parallel plan
+PARALLEL_SETTINGS = (
+    "max_parallel_workers_per_gather",
+    "max_parallel_workers",
+    "max_worker_processes",
+    "parallel_setup_cost",
+    "parallel_tuple_cost",
+    "min_parallel_table_scan_size",
+    "enable_parallel_hash",
+)
+
+# Settings which limit the memory of Sort, Hash and Aggregate nodes before they spill to disk
+MEMORY_SETTINGS = ("work_mem", "hash_mem_multiplier")
+
+# Settings retrieved along with every QEP
+SETTINGS = PARALLEL_SETTINGS + MEMORY_SETTINGS
+
+# Settings which are sizes, these are converted to kB when they are retrieved
+SIZE_SETTINGS = ("min_parallel_table_scan_size", "work_mem")
+
+# Number of kB in each unit used by the size settings in pg_settings
+SIZE_UNITS_KB = {"kB": 1, "8kB": 8, "MB": 1024}
+
+# A generic plan is considered much worse if its cost is this many times the cost of the custom plan
+GENERIC_PLAN_RATIO = 1.5
 
 
 class Node:
-    def __init__(self, query_plan):
+    def __init__(self, query_plan, settings=None):
         """Initialises a node with its relevant query plan.
         Parse each attribute of the plan and set as an attribute of the object, such as:
         1. Node type
@@ -18,12 +49,27 @@ class Node:
 
         Args:
             query_plan (dict):  Query plan that is generated by PostgreSQL
+            settings (dict, optional): Current values of the PostgreSQL settings in
+            SETTINGS. Defaults to None.
         """
         self.plans = []
         for key in query_plan:
             setattr(self, key.lower().replace(" ", "_"), query_plan.get(key))
+        hash_mem_multiplier = float((settings or {}).get("hash_mem_multiplier", 1))
+        work_mem_kb = int((settings or {}).get("work_mem", 0))
         explainer = Annotation.annotation_dict.get(self.node_type, defaultAnnotation)
-        self.explanation = explainer(query_plan)
+        self.explanation = (
+            explainer(query_plan)
+            + workersAnnotation(query_plan)
+            + memoryAnnotation(query_plan, hash_mem_multiplier, work_mem_kb)
+        )
+        self.worker_skew = workerSkew(workerStats(query_plan))
+
+        # Recommendations and diagnostics of this node, shown by the plan explorer
+        self.diagnostics = []
+        self.memory_usage = memoryUsage(
+            query_plan, hash_mem_multiplier, work_mem_kb
+        )
 
     def __str__(self):
         """Overrides the __str__ method to represent the class objects as a string.
@@ -35,26 +81,49 @@ class Node:
 
 
 class QueryPlan:
-    def __init__(self, query):
+    def __init__(self, query, settings=None):
         """Initialises the root node with the root query plan.
         Constructs the graph and calculate attributes of the QEP:
         1. Total cost
         2. Plan rows
         3. Number of sequential scan nodes
         4. Number of index scan nodes
-        4. Explanation of the query plan
+        5. Number of parallel workers planned and launched
+        6. Peak memory, number of spilled nodes and estimated work_mem
+        7. Explanation of the query plan
+        8. Recommendations for parallel execution
+        9. Memory diagnostics of Sort, Hash and Aggregate nodes
+
+        Each node is given a node_id, its index in self.nodes in depth-first order,
+        and a rollup of its subtree for use by the plan explorer.
 
         Args:
             query (dict): Query plan that is generated by PostgreSQL
+            settings (dict, optional): Current values of the PostgreSQL settings in
+            SETTINGS, used to make the recommendations. Defaults to None.
         """
+        self.settings = settings or {}
         self.graph = nx.DiGraph()
-        self.root = Node(query)
+        self.root = Node(query, self.settings)
+        self.root.node_id = 0
+        self.nodes = [self.root]
         self.construct_graph(self.root)
+        self.calculate_rollups(self.root)
         self.total_cost = self.calculate_total_cost()
         self.plan_rows = self.calculate_plan_rows()
         self.num_seq_scan_nodes = self.calculate_num_nodes("Seq Scan")
         self.num_index_scan_nodes = self.calculate_num_nodes("Index Scan")
+        self.num_parallel_seq_scan_nodes = self.calculate_num_parallel_nodes(
+            "Seq Scan"
+        )
+        self.workers_planned = self.calculate_workers("workers_planned")
+        self.workers_launched = self.calculate_workers("workers_launched")
+        self.peak_memory_kb = self.calculate_peak_memory()
+        self.num_spilled_nodes = self.calculate_num_spilled_nodes()
+        self.required_work_mem_kb = self.calculate_required_work_mem()
         self.explanation = self.create_explanation(self.root)
+        self.parallel_recommendations = self.create_parallel_recommendations()
+        self.memory_diagnostics = self.create_memory_diagnostics()
 
     def construct_graph(self, root):
         """Constructs the graph recursively by forming an edge between each node
@@ -65,10 +134,43 @@ class QueryPlan:
         """
         self.graph.add_node(root)
         for child in root.plans:
-            child_node = Node(child)
+            child_node = Node(child, self.settings)
+            child_node.node_id = len(self.nodes)
+            self.nodes.append(child_node)
             self.graph.add_edge(root, child_node)
             self.construct_graph(child_node)
 
+    def calculate_rollups(self, node: Node):
+        """Calculates the rollup of each subtree recursively, so that a collapsed subtree
+        can be summarised without sending all of its nodes:
+        1. Self cost of the node, i.e. its total cost excluding its child nodes
+        2. Sum of the self cost of all nodes in the subtree
+        3. Sum of the plan rows of all nodes in the subtree
+        4. Number of nodes in the subtree, in total and per node type
+
+        Args:
+            node (Node): Root of the subtree.
+        """
+        children = list(self.graph[node])
+        for child in children:
+            self.calculate_rollups(child)
+
+        node.self_cost = max(
+            0, node.total_cost - sum(child.total_cost for child in children)
+        )
+        node.subtree_cost = node.self_cost
+        node.subtree_rows = node.plan_rows
+        node.subtree_num_nodes = 1
+        node.subtree_node_types = {node.node_type: 1}
+        for child in children:
+            node.subtree_cost += child.subtree_cost
+            node.subtree_rows += child.subtree_rows
+            node.subtree_num_nodes += child.subtree_num_nodes
+            for node_type, count in child.subtree_node_types.items():
+                node.subtree_node_types[node_type] = (
+                    node.subtree_node_types.get(node_type, 0) + count
+                )
+
     def create_explanation(self, node: Node) -> str:
         """Creates explanation of the entire QEP recursively by combining the explanations
         for each node.
@@ -100,6 +202,259 @@ class QueryPlan:
                 num_nodes += 1
         return num_nodes
 
+    def calculate_num_parallel_nodes(self, node_type: str) -> int:
+        """Calculate the number of nodes with a specified node type that are executed
+        by parallel workers, e.g. Parallel Seq Scan.
+
+        Args:
+            node_type (str): Type of node (e.g. Seq Scan, Hash)
+
+        Returns:
+            int: Number of parallel aware nodes with the specified node type.
+        """
+        num_nodes = 0
+        for node in self.graph.nodes:
+            if node.node_type == node_type and getattr(node, "parallel_aware", False):
+                num_nodes += 1
+        return num_nodes
+
+    def calculate_workers(self, attribute: str) -> int:
+        """Calculate the total number of parallel workers over all Gather and
+        Gather Merge nodes.
+
+        Args:
+            attribute (str): Either workers_planned or workers_launched. Workers
+            launched is only available in ANALYZE mode.
+
+        Returns:
+            int: Total number of workers.
+        """
+        workers = 0
+        for node in self.graph.nodes:
+            workers += getattr(node, attribute, 0)
+        return workers
+
+    def is_below_gather(self, node: Node) -> bool:
+        """Check whether a node is executed below a Gather or Gather Merge node.
+
+        Args:
+            node (Node): Node in the graph representing the QEP.
+
+        Returns:
+            bool: Whether the node runs in parallel workers.
+        """
+        for ancestor in nx.ancestors(self.graph, node):
+            if ancestor.node_type in ("Gather", "Gather Merge"):
+                return True
+        return False
+
+    def is_parallelized(self, node: Node) -> bool:
+        """Check whether the work of a node is split between parallel workers.
+        A node below a Gather which is not parallel aware, e.g. the build side of a
+        non-parallel Hash, is repeated in full by every worker instead.
+
+        Args:
+            node (Node): Node in the graph representing the QEP.
+
+        Returns:
+            bool: Whether the node is parallelized.
+        """
+        return getattr(node, "parallel_aware", False) and self.is_below_gather(node)
+
+    def setting(self, name: str) -> str:
+        """Formats the current value of a setting for use in a recommendation.
+
+        Args:
+            name (str): Name of the PostgreSQL setting.
+
+        Returns:
+            str: The setting, along with its current value if it is known.
+        """
+        if name not in self.settings:
+            return bold(name)
+        value = self.settings[name]
+        if name in SIZE_SETTINGS:
+            value = formatKilobytes(int(value))
+        return f"{bold(name)} (currently {value})"
+
+    def repeated_scan_advice(self, node: Node) -> str:
+        """Advises how to make a scan which every worker repeats parallel aware,
+        depending on the operation it is the input of.
+
+        Args:
+            node (Node): Scan below a Gather which is not parallel aware.
+
+        Returns:
+            str: Advice to be appended to the recommendation.
+        """
+        parents = [parent.node_type for parent in self.graph.predecessors(node)]
+        if "Hash" in parents:
+            if self.settings.get("enable_parallel_hash") == "off":
+                return (
+                    f"Every worker builds its own copy of the hash table, consider {bold('SET enable_parallel_hash = on')} "
+                    f"so that the workers share a single hash table built by a {italics('Parallel Seq Scan')}."
+                )
+            return (
+                f"Every worker builds its own copy of the hash table, check that {self.setting('enable_parallel_hash')} "
+                f"is on and that the hash table fits in {self.setting('work_mem')}, so that the planner chooses a "
+                f"{italics('Parallel Hash Join')} instead."
+            )
+        if "Nested Loop" in parents or "Materialize" in parents:
+            return (
+                f"It is the inner side of a {italics('Nested Loop')}, consider an index on the join key of {bold(node.relation_name)} "
+                f"so that each worker looks up its rows instead of scanning the relation."
+            )
+        return (
+            f"The {italics(parents[0])} operation it feeds into has no parallel aware variant, "
+            f"consider rewriting the query so that {bold(node.relation_name)} is joined or aggregated before the {italics(parents[0])}."
+        )
+
+    def create_parallel_recommendations(self) -> list:
+        """Creates recommendations for the parallel execution of the QEP:
+        1. Gather nodes which launched fewer workers than planned
+        2. Nodes whose parallel workers are skewed
+        3. Sequential scans on large relations which are not parallelized
+
+        The recommendations are also added to the diagnostics of their node.
+
+        Returns:
+            list: Recommendations to be displayed to the user.
+        """
+        recommendations = []
+        for node in self.nodes:
+            node_recommendations = []
+            planned = getattr(node, "workers_planned", 0)
+            launched = getattr(node, "workers_launched", planned)
+            if launched < planned:
+                node_recommendations.append(
+                    f"The {italics(node.node_type)} operation launched {bold(str(launched))} of {bold(str(planned))} planned workers. "
+                    f"The pool of background workers is exhausted, consider raising {self.setting('max_parallel_workers')} "
+                    f"and {self.setting('max_worker_processes')}."
+                )
+
+            if node.worker_skew >= WORKER_SKEW_RATIO:
+                node_recommendations.append(
+                    f"The workers of the {italics(node.node_type)} operation are skewed, the busiest process handled "
+                    f"{bold(f'{node.worker_skew:.1f}x')} the average number of rows. "
+                    f"The query only finishes when the slowest worker does."
+                )
+
+            relation = getattr(node, "relation_name", None)
+            if (
+                node.node_type == "Seq Scan"
+                and relation in LARGE_RELATIONS
+                and not self.is_parallelized(node)
+            ):
+                result = f"The {italics(node.node_type)} operation on the large relation {bold(relation)} is not parallelized. "
+                if self.is_below_gather(node):
+                    # The query is already parallel, more workers would only repeat the scan more often
+                    result += (
+                        "It runs below a Gather without being parallel aware, so every worker repeats the full scan. "
+                        + self.repeated_scan_advice(node)
+                    )
+                elif self.settings.get("max_parallel_workers_per_gather") == "0":
+                    result += (
+                        f"Parallel query is disabled by {self.setting('max_parallel_workers_per_gather')}, "
+                        f"consider {bold('SET max_parallel_workers_per_gather = 2')} or higher."
+                    )
+                else:
+                    result += (
+                        f"Consider raising {self.setting('max_parallel_workers_per_gather')}, or lowering "
+                        f"{self.setting('parallel_setup_cost')}, {self.setting('parallel_tuple_cost')} "
+                        f"and {self.setting('min_parallel_table_scan_size')} so that the planner chooses a parallel scan."
+                    )
+                node_recommendations.append(result)
+
+            node.diagnostics += node_recommendations
+            recommendations += node_recommendations
+        return recommendations
+
+    def calculate_peak_memory(self) -> int:
+        """Calculate the memory used by all Sort, Hash and Aggregate nodes in ANALYZE mode.
+        The nodes of a QEP may run at the same time, so this is an upper bound of the
+        peak memory of the query.
+
+        Returns:
+            int: Peak memory of QEP in kB
+        """
+        peak_memory = 0
+        for node in self.graph.nodes:
+            if node.memory_usage:
+                peak_memory += node.memory_usage["memory_kb"]
+        return peak_memory
+
+    def calculate_num_spilled_nodes(self) -> int:
+        """Calculate the number of nodes that spilled to disk in ANALYZE mode.
+
+        Returns:
+            int: Number of spilled nodes.
+        """
+        num_nodes = 0
+        for node in self.graph.nodes:
+            if node.memory_usage and node.memory_usage["spilled"]:
+                num_nodes += 1
+        return num_nodes
+
+    def calculate_required_work_mem(self) -> int:
+        """Estimate the work_mem that keeps every node of the QEP in memory.
+
+        Returns:
+            int: Estimated work_mem in kB
+        """
+        work_mem = 0
+        for node in self.graph.nodes:
+            if node.memory_usage:
+                work_mem = max(work_mem, node.memory_usage["work_mem_kb"])
+        return math.ceil(work_mem)
+
+    def create_memory_diagnostics(self) -> list:
+        """Creates the work_mem that would keep every Sort, Hash and Aggregate node in
+        memory, followed by a summary of the memory usage of each of them.
+        The plan explorer does not need these, as memoryAnnotation already adds them
+        to the explanation of each node.
+
+        Returns:
+            list: Diagnostics to be displayed to the user.
+        """
+        diagnostics = []
+        for node in self.nodes:
+            usage = node.memory_usage
+            if not usage:
+                continue
+            if usage["spilled"]:
+                diagnostic = (
+                    f"The {italics(node.node_type)} operation {bold('spilled to disk')} "
+                    f"and needs an estimated {bold('work_mem')} of roughly {bold(formatKilobytes(usage['work_mem_kb']))}."
+                )
+            else:
+                diagnostic = f"The {italics(node.node_type)} operation fits in memory, using {bold(formatKilobytes(usage['memory_kb']))}."
+            diagnostics.append(diagnostic)
+
+        if self.num_spilled_nodes:
+            work_mem_mb = math.ceil(self.required_work_mem_kb / 1024)
+            statement = f"SET work_mem = '{work_mem_mb}MB'"
+            result = f"Running {bold(statement)} is estimated to keep every operation in memory"
+            if "work_mem" in self.settings:
+                result += f" (currently {formatKilobytes(int(self.settings['work_mem']))})"
+            diagnostics.insert(0, result + ".")
+        return diagnostics
+
+    def operator_tree(self, node: Node = None) -> tuple:
+        """Creates the operator tree of the QEP recursively, which can be used to check
+        whether two QEPs have the same shape regardless of their cost.
+
+        Args:
+            node (Node, optional): Root of the subtree. Defaults to the root of the QEP.
+
+        Returns:
+            tuple: Node type followed by the operator trees of its child nodes.
+        """
+        if node is None:
+            node = self.root
+        return (node.node_type,) + tuple(
+            self.operator_tree(child) for child in self.graph[node]
+        )
+
     def calculate_plan_rows(self) -> int:
         """Calculate the total plan rows of the QEP via the summation of individual plan rows of each node.
 
@@ -150,6 +505,191 @@ class QueryPlan:
         return graph_name
 
 
+class PreparedQueryPlans:
+    def __init__(self, generic_plan, custom_plans):
+        """Initialises the comparison between the generic plan of a prepared statement
+        and its custom plans for each set of parameter values.
+        PostgreSQL chooses between them by comparing their estimated costs, so the
+        estimated cost of the root node is compared here as well.
+
+        Args:
+            generic_plan (QueryPlan): Plan with plan_cache_mode = force_generic_plan.
+            custom_plans (list): Tuples of the parameter values and the QueryPlan with
+            plan_cache_mode = force_custom_plan.
+        """
+        self.generic_plan = generic_plan
+        self.generic_cost = generic_plan.root.total_cost
+        self.comparisons = []
+        for parameters, custom_plan in custom_plans:
+            custom_cost = custom_plan.root.total_cost
+            self.comparisons.append(
+                {
+                    "parameters": parameters,
+                    "custom_cost": custom_cost,
+                    "generic_cost": self.generic_cost,
+                    "ratio": self.generic_cost / custom_cost if custom_cost else 1.0,
+                    "same_plan": custom_plan.operator_tree()
+                    == generic_plan.operator_tree(),
+                }
+            )
+        costs = [comparison["custom_cost"] for comparison in self.comparisons]
+        self.min_custom_cost = min(costs)
+        self.max_custom_cost = max(costs)
+        self.average_custom_cost = sum(costs) / len(costs)
+        self.explanation = self.create_explanation()
+
+    def create_explanation(self) -> list:
+        """Creates a summary of how the cost varies across the parameter sets, and
+        which parameter sets the generic plan is much worse for.
+
+        Returns:
+            list: Explanation to be displayed to the user.
+        """
+        result = [
+            f"The cost of the custom plans ranges from {bold(str(int(self.min_custom_cost)))} "
+            f"to {bold(str(int(self.max_custom_cost)))}, with an average of {bold(str(int(self.average_custom_cost)))}. "
+            f"The cost of the generic plan is {bold(str(int(self.generic_cost)))}."
+        ]
+
+        # In auto mode, PostgreSQL switches to the generic plan after five executions
+        # if it is not more expensive than the average custom plan
+        if self.generic_cost <= self.average_custom_cost:
+            result.append(
+                f"In the default {bold('plan_cache_mode = auto')}, PostgreSQL is likely to switch to the generic plan after five executions."
+            )
+        else:
+            result.append(
+                f"In the default {bold('plan_cache_mode = auto')}, PostgreSQL is likely to keep planning a custom plan for every execution."
+            )
+
+        for comparison in self.comparisons:
+            if comparison["ratio"] < GENERIC_PLAN_RATIO:
+                continue
+            ratio = f"{comparison['ratio']:.1f}x"
+            explanation = (
+                f"For the parameters {bold(', '.join(comparison['parameters']))}, the generic plan is "
+                f"{bold(ratio)} as expensive as the custom plan"
+            )
+            if not comparison["same_plan"]:
+                explanation += ", which uses different operations"
+            result.append(explanation + ".")
+        return result
+
+
+def format_operator_tree(tree) -> str:
+    """Formats an operator tree returned by QueryPlan.operator_tree as a single line,
+    e.g. Hash Join(Seq Scan, Hash(Seq Scan)).
+
+    Args:
+        tree (tuple): Node type followed by the operator trees of its child nodes.
+
+    Returns:
+        str: The formatted operator tree.
+    """
+    node_type, children = tree[0], tree[1:]
+    if not children:
+        return node_type
+    return f"{node_type}({', '.join(format_operator_tree(child) for child in children)})"
+
+
+def format_server_version(server_version) -> str:
+    """Formats the server version of a connection, e.g. 160002 as 16.2 and 90624 as 9.6.24.
+
+    Args:
+        server_version (int): Server version reported by psycopg2.
+
+    Returns:
+        str: The formatted server version.
+    """
+    if not server_version:
+        return "unknown"
+    if server_version >= 100000:
+        return f"{server_version // 10000}.{server_version % 10000}"
+    return f"{server_version // 10000}.{server_version // 100 % 100}.{server_version % 100}"
+
+
+class TargetComparison:
+    def __init__(self, results):
+        """Initialises the comparison of the QEPs of one query on several targets.
+        The first target which returned a QEP is used as the baseline, and the
+        operator tree and estimated cost of the root node of every other QEP are
+        compared against it.
+        The operator tree itself is only shown for small plans, so that the page
+        does not grow with the size of the plans.
+
+        Args:
+            results (list): Results returned by Target.explain for each target.
+        """
+        self.results = results
+        plans = [result for result in results if result["plan"] is not None]
+        self.baseline = plans[0] if plans else None
+        self.comparisons = [self.compare(result) for result in results]
+        self.explanation = self.create_explanation()
+
+    def compare(self, result) -> dict:
+        """Compares the result of a single target against the baseline.
+
+        Args:
+            result (dict): Result returned by Target.explain.
+
+        Returns:
+            dict: Summary of the QEP of the target to be displayed to the user.
+        """
+        comparison = {
+            "name": result["name"],
+            "server_version": format_server_version(result["server_version"]),
+            "error": result["error"],
+        }
+        plan = result["plan"]
+        if plan is None:
+            return comparison
+
+        baseline_plan = self.baseline["plan"]
+        baseline_cost = baseline_plan.root.total_cost
+        comparison.update(
+            {
+                "cost": plan.root.total_cost,
+                "ratio": plan.root.total_cost / baseline_cost if baseline_cost else 1.0,
+                "num_nodes": len(plan.graph.nodes),
+                "same_plan": plan.operator_tree() == baseline_plan.operator_tree(),
+                "operator_tree": (
+                    format_operator_tree(plan.operator_tree())
+                    if is_small_plan(plan)
+                    else None
+                ),
+            }
+        )
+        return comparison
+
+    def create_explanation(self) -> list:
+        """Creates a summary of the differences between the targets.
+
+        Returns:
+            list: Explanation to be displayed to the user.
+        """
+        if self.baseline is None:
+            return ["The query could not be explained on any target."]
+
+        result = []
+        for comparison in self.comparisons:
+            if comparison["error"]:
+                result.append(
+                    f"The query could not be explained on {bold(comparison['name'])}: {comparison['error']}"
+                )
+            elif comparison["name"] != self.baseline["name"]:
+                ratio = f"{comparison['ratio']:.2f}x"
+                explanation = (
+                    f"On {bold(comparison['name'])} (PostgreSQL {comparison['server_version']}), "
+                    f"the estimated cost is {bold(ratio)} the cost on {bold(self.baseline['name'])}"
+                )
+                if comparison["same_plan"]:
+                    explanation += " with the same operations."
+                else:
+                    explanation += f" and the plan uses {bold('different operations')}."
+                result.append(explanation)
+        return result
+
+
 def get_tree_node_pos(G, root=None, width=1.0, height=1, vert_gap=0.1, vert_loc=0, xcenter=0.5):
     """From Joel's answer at https://stackoverflow.com/a/29597209/2966723.
     Licensed under Creative Commons Attribution-Share Alike
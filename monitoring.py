@@ -0,0 +1,343 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from psycopg2.extras import RealDictCursor
+
+from preprocessing import query_processor
+
+# Sessions connected to the same database as the visualiser, excluding the sampler itself.
+ACTIVITY_QUERY = """
+SELECT pid,
+       usename,
+       application_name,
+       state,
+       wait_event_type,
+       wait_event,
+       EXTRACT(EPOCH FROM now() - query_start)::float AS query_seconds,
+       left(query, 200) AS query
+FROM pg_stat_activity
+WHERE pid <> pg_backend_pid()
+  AND datname = current_database()
+"""
+
+# Only locks that have not been granted yet, together with the sessions blocking them.
+LOCKS_QUERY = """
+SELECT l.pid,
+       l.locktype,
+       l.mode,
+       c.relname AS relation,
+       pg_blocking_pids(l.pid) AS blocked_by
+FROM pg_locks l
+LEFT JOIN pg_class c ON c.oid = l.relation
+WHERE NOT l.granted
+  AND l.pid <> pg_backend_pid()
+"""
+
+# pg_stat_io is only available from PostgreSQL 16 onwards.
+STAT_IO_QUERY = """
+SELECT backend_type || ':' || object || ':' || context AS name,
+       COALESCE(reads, 0) AS reads,
+       COALESCE(writes, 0) AS writes,
+       COALESCE(extends, 0) AS extends,
+       COALESCE(hits, 0) AS hits,
+       COALESCE(evictions, 0) AS evictions
+FROM pg_stat_io
+"""
+
+STATIO_TABLES_QUERY = """
+SELECT relname AS name,
+       COALESCE(heap_blks_read, 0) AS heap_blks_read,
+       COALESCE(heap_blks_hit, 0) AS heap_blks_hit,
+       COALESCE(idx_blks_read, 0) AS idx_blks_read,
+       COALESCE(idx_blks_hit, 0) AS idx_blks_hit
+FROM pg_statio_user_tables
+"""
+
+# Seconds a viewer waits for a new sample before sending a keepalive comment.
+KEEPALIVE_SECONDS = 15
+
+
+def diff_rows(previous, current):
+    """Compare two lists of rows which each carry a unique "key" field.
+
+    Args:
+        previous (list): Rows of the previous sample.
+        current (list): Rows of the current sample.
+
+    Returns:
+        dict: Rows that were added or changed, and the keys of rows that were removed.
+    """
+    previous_rows = {row["key"]: row for row in previous}
+    current_rows = {row["key"]: row for row in current}
+    return {
+        "added": [
+            row for key, row in current_rows.items() if key not in previous_rows
+        ],
+        "changed": [
+            row
+            for key, row in current_rows.items()
+            if key in previous_rows and previous_rows[key] != row
+        ],
+        "removed": [key for key in previous_rows if key not in current_rows],
+    }
+
+
+def diff_counters(previous, current):
+    """Compute how much each cumulative I/O counter has increased between two samples.
+    A name which only appears in the current sample has no baseline yet, so its
+    counters are not reported until the next sample.
+
+    Args:
+        previous (dict): Counters of the previous sample, keyed by name.
+        current (dict): Counters of the current sample, keyed by name.
+
+    Returns:
+        dict: Non-zero increments keyed by name.
+    """
+    result = {}
+    for name, counters in current.items():
+        before = previous.get(name, {})
+        increments = {
+            counter: value - before.get(counter, value)
+            for counter, value in counters.items()
+        }
+        if any(increments.values()):
+            result[name] = increments
+    return result
+
+
+def format_event(event, event_id, data):
+    """Format a single Server-Sent Event.
+
+    Args:
+        event (str): Name of the event.
+        event_id (str): Id of the event, which the browser sends back as the
+        Last-Event-ID header when it reconnects.
+        data (str): JSON encoded payload.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    return f"event: {event}\nid: {event_id}\ndata: {data}\n\n"
+
+
+class ActivitySampler:
+    def __init__(self, connect, interval, buffer_size):
+        """Initialises a sampler which polls the activity, lock and I/O statistics
+        of the database on a single background thread.
+        Every viewer reads from the same ring buffer of samples, so the cost of
+        sampling does not depend on the number of viewers.
+        The thread is only started by start(), once the first viewer connects.
+
+        Args:
+            connect (function): Function which opens a new database connection.
+            interval (float): Seconds between two samples.
+            buffer_size (int): Number of samples kept in the ring buffer.
+        """
+        self.connect = connect
+        self.interval = interval
+        self.samples = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.conn = None
+        self.io_query = None
+        self.seq = 0
+
+        # Sequence numbers restart whenever the process restarts, so event ids are
+        # prefixed with an id of this process to recognise ids from a previous run
+        self.boot_id = uuid.uuid4().hex[:12]
+
+    def start(self):
+        """Starts the background thread if it is not running yet."""
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="activity-sampler", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        """Takes a sample every interval until the process exits."""
+        while True:
+            started = time.monotonic()
+            try:
+                self.publish(self.take_sample())
+            except Exception as error:
+                print(f"Exception encountered while sampling, reconnecting: {error}")
+                self.close_connection()
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def open_connection(self):
+        """Opens the connection used by the sampler.
+        Autocommit is enabled so that every poll sees fresh statistics instead of
+        the snapshot taken at the start of a transaction.
+        """
+        self.conn = self.connect()
+        self.conn.autocommit = True
+        if self.conn.server_version >= 160000:
+            self.io_query = STAT_IO_QUERY
+        else:
+            self.io_query = STATIO_TABLES_QUERY
+
+    def close_connection(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+
+    def take_sample(self):
+        """Polls pg_stat_activity, pg_locks and the I/O statistics once.
+
+        Returns:
+            dict: The sampled rows, with a unique "key" field added to each row.
+        """
+        if self.conn is None:
+            self.open_connection()
+
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(ACTIVITY_QUERY)
+            activity = [dict(row, key=str(row["pid"])) for row in cursor.fetchall()]
+
+            cursor.execute(LOCKS_QUERY)
+            locks = [
+                dict(
+                    row,
+                    key=f"{row['pid']}:{row['locktype']}:{row['relation']}:{row['mode']}",
+                )
+                for row in cursor.fetchall()
+            ]
+
+            cursor.execute(self.io_query)
+            io = {row.pop("name"): dict(row) for row in cursor.fetchall()}
+
+        return {
+            "timestamp": time.time(),
+            "activity": activity,
+            "locks": locks,
+            "io": io,
+        }
+
+    def publish(self, sample):
+        """Computes the delta against the previous sample, appends the sample to the
+        ring buffer and wakes up every viewer.
+        Payloads are encoded once here rather than once per viewer.
+
+        Args:
+            sample (dict): Sample returned by take_sample.
+        """
+        with self.condition:
+            previous = self.samples[-1] if self.samples else None
+            if previous is None:
+                io_delta = {}
+                delta = {
+                    "activity": diff_rows([], sample["activity"]),
+                    "locks": diff_rows([], sample["locks"]),
+                }
+            else:
+                io_delta = diff_counters(previous["io"], sample["io"])
+                delta = {
+                    "activity": diff_rows(previous["activity"], sample["activity"]),
+                    "locks": diff_rows(previous["locks"], sample["locks"]),
+                }
+            delta["timestamp"] = sample["timestamp"]
+            delta["io"] = io_delta
+
+            self.seq += 1
+            sample["seq"] = self.seq
+            sample["delta_json"] = json.dumps(delta, default=str)
+            sample["snapshot_json"] = json.dumps(
+                {
+                    "timestamp": sample["timestamp"],
+                    "activity": sample["activity"],
+                    "locks": sample["locks"],
+                    "io": io_delta,
+                },
+                default=str,
+            )
+            self.samples.append(sample)
+            self.condition.notify_all()
+
+    def event_id(self, seq):
+        """Formats the event id of a sample.
+
+        Args:
+            seq (int): Sequence number of the sample.
+
+        Returns:
+            str: The event id, e.g. 3f2a9c1b0d4e-42.
+        """
+        return f"{self.boot_id}-{seq}"
+
+    def parse_event_id(self, event_id):
+        """Obtains the sequence number from an event id sent by this process.
+
+        Args:
+            event_id (str): Event id, e.g. from the Last-Event-ID header.
+
+        Returns:
+            int: The sequence number, or None if the event id is missing, malformed
+            or was sent before the process restarted.
+        """
+        boot_id, _, seq = (event_id or "").rpartition("-")
+        if boot_id != self.boot_id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def stream(self, last_event_id=None):
+        """Generates Server-Sent Events for a single viewer.
+        A viewer which is new, which has fallen behind the ring buffer, or which
+        reconnects with an event id of a previous process receives a full snapshot
+        first and only deltas afterwards.
+
+        Args:
+            last_event_id (str, optional): Id of the last event the viewer has
+            received, from the Last-Event-ID header. Defaults to None.
+
+        Yields:
+            str: Events in the text/event-stream format.
+        """
+        last_seq = self.parse_event_id(last_event_id)
+        while True:
+            with self.condition:
+                ready = self.condition.wait_for(
+                    lambda: self.samples and self.samples[-1]["seq"] != last_seq,
+                    timeout=KEEPALIVE_SECONDS,
+                )
+                if ready:
+                    oldest = self.samples[0]["seq"]
+                    latest = self.samples[-1]
+                    if last_seq is None or not oldest - 1 <= last_seq < latest["seq"]:
+                        pending = None
+                    else:
+                        pending = [
+                            self.samples[seq - oldest]
+                            for seq in range(last_seq + 1, latest["seq"] + 1)
+                        ]
+
+            if not ready:
+                yield ": keepalive\n\n"
+                continue
+
+            if pending is None:
+                yield format_event(
+                    "snapshot", self.event_id(latest["seq"]), latest["snapshot_json"]
+                )
+            else:
+                for sample in pending:
+                    yield format_event(
+                        "delta", self.event_id(sample["seq"]), sample["delta_json"]
+                    )
+            last_seq = latest["seq"]
+
+
+activity_sampler = ActivitySampler(
+    query_processor.start_db_connection,
+    interval=float(os.getenv("MONITOR_INTERVAL_SECONDS", 2)),
+    buffer_size=int(os.getenv("MONITOR_BUFFER_SIZE", 300)),
+)
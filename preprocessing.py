@@ -1,5 +1,12 @@
+import csv
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from os import *
 from psycopg2 import connect, sql
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from config.base import project_root
 from functools import wraps
 from annotation import *
@@ -21,7 +28,14 @@ def validate(query):
         output["error"] = True
         output["error_message"] = "Query is empty."
 
-    if not query_processor.query_valid(query):
+    try:
+        valid = query_processor.query_valid(query)
+    except PoolError as error:
+        output["error"] = True
+        output["error_message"] = f"The database is busy, please try again later: {error}"
+        return output
+
+    if not valid:
         output["error"] = True
         output["error_message"] = "Query is invalid."
         return output
@@ -29,27 +43,261 @@ def validate(query):
     return output
 
 
+def parse_parameter_sets(text):
+    """Parse the parameter sets entered by the user.
+    Each line is one set of parameter values, separated by commas. Values containing
+    commas can be quoted, e.g. 1, "BUILDING, AUTOMOBILE".
+
+    Args:
+        text (string): Parameter sets that were entered by the user.
+
+    Returns:
+        list: List of parameter sets, each being a list of values.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    return [
+        [value.strip() for value in values]
+        for values in csv.reader(lines, skipinitialspace=True)
+    ]
+
+
+def validate_prepared(query, parameter_sets, analyze=False, compare_targets=False):
+    """Check if the parameterized query and its parameter sets are valid.
+
+    Args:
+        query (string): Query string with $1, $2, ... placeholders entered by the user.
+        parameter_sets (list): Parameter sets returned by parse_parameter_sets.
+        analyze (bool, optional): Whether EXPLAIN ANALYZE was requested, which is not
+        supported for prepared statements. Defaults to False.
+        compare_targets (bool, optional): Whether comparing the targets was requested,
+        which is not supported for prepared statements. Defaults to False.
+
+    Returns:
+        dict: Output dict consisting of error status and error message.
+    """
+    output = {"query": query, "error": False, "error_message": ""}
+
+    if not len(query):
+        output["error"] = True
+        output["error_message"] = "Query is empty."
+        return output
+
+    if analyze or compare_targets:
+        output["error"] = True
+        output["error_message"] = "EXPLAIN ANALYZE and comparing targets are not supported for prepared statements."
+        return output
+
+    if len({len(values) for values in parameter_sets}) != 1:
+        output["error"] = True
+        output["error_message"] = "Every parameter set must have the same number of values."
+        return output
+
+    placeholders = [int(number) for number in re.findall(r"\$(\d+)", query)]
+    if not placeholders:
+        output["error"] = True
+        output["error_message"] = "Query has no $1, $2, ... placeholders for the parameter sets."
+        return output
+
+    num_values = len(parameter_sets[0])
+    if max(placeholders) != num_values:
+        output["error"] = True
+        output["error_message"] = (
+            f"Query uses parameters up to ${max(placeholders)}, "
+            f"but each parameter set has {num_values} value(s)."
+        )
+        return output
+
+    return output
+
+
+def fetch_settings(cursor, names) -> dict:
+    """Retrieves the current values of PostgreSQL settings.
+    pg_settings reports sizes in their own unit, e.g. min_parallel_table_scan_size
+    in 8 kB blocks, so every size is converted to kB.
+
+    Args:
+        cursor (cursor): Cursor of the database connection.
+        names (tuple): Names of the settings.
+
+    Returns:
+        dict: Value of each setting, keyed by name.
+    """
+    cursor.execute(
+        "SELECT name, setting, unit FROM pg_settings WHERE name = ANY(%s)",
+        (list(names),),
+    )
+    settings = {}
+    for name, setting, unit in cursor.fetchall():
+        if unit in SIZE_UNITS_KB:
+            setting = str(int(setting) * SIZE_UNITS_KB[unit])
+        settings[name] = setting
+    return settings
+
+
+def fetch_query_plan(cursor, query, analyze=False) -> QueryPlan:
+    """Retrieves the execution plan of a statement along with the current settings.
+
+    Args:
+        cursor (cursor): Cursor of the database connection.
+        query (str): Query string that was entered by the user.
+        analyze (bool, optional): Whether to execute the query with EXPLAIN ANALYZE.
+        Defaults to False.
+
+    Returns:
+        QueryPlan: The QEP of the statement.
+    """
+    options = "ANALYZE, VERBOSE, FORMAT JSON" if analyze else "FORMAT JSON"
+    cursor.execute(f"EXPLAIN ({options}) " + query)
+    plan = cursor.fetchall()
+    query_plan_dict: dict = plan[0][0][0]["Plan"]
+    return QueryPlan(query_plan_dict, fetch_settings(cursor, SETTINGS))
+
+
+class Target:
+    def __init__(self, name):
+        """Initialises a named PostgreSQL instance to explain queries against.
+        The connection settings of the target are read from POSTGRES_<NAME>_HOST,
+        POSTGRES_<NAME>_PORT, etc., falling back to POSTGRES_HOST, POSTGRES_PORT, etc.
+        The connection pool is only created when the target is first used, so an
+        unreachable target does not prevent the application from starting.
+
+        Args:
+            name (str): Name of the target, as listed in POSTGRES_TARGETS.
+        """
+        self.name = name
+        self.connection_kwargs = {
+            "dbname": self.getenv("DBNAME"),
+            "user": self.getenv("USERNAME"),
+            "password": self.getenv("PASSWORD"),
+            "host": self.getenv("HOST"),
+            "port": self.getenv("PORT"),
+        }
+        self.min_connections = int(self.getenv("POOL_MIN_CONNECTIONS", 1))
+        self.max_connections = int(self.getenv("POOL_MAX_CONNECTIONS", 5))
+        self.pool_timeout = float(self.getenv("POOL_TIMEOUT_SECONDS", 30))
+        self.pool = None
+        self.lock = threading.Lock()
+
+        # ThreadedConnectionPool raises instead of waiting once every connection is in
+        # use, so a request first waits for one of the max_connections slots
+        self.slots = threading.BoundedSemaphore(self.max_connections)
+
+    def getenv(self, key, default=None):
+        """Reads a setting of the target from the environment.
+
+        Args:
+            key (str): Name of the setting without the POSTGRES_ prefix, e.g. HOST.
+            default (optional): Value used if the setting is not set at all.
+
+        Returns:
+            str: Value of the setting.
+        """
+        prefix = "POSTGRES_" + self.name.upper().replace("-", "_")
+        return os.getenv(f"{prefix}_{key}", os.getenv(f"POSTGRES_{key}", default))
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection from the pool of the target. Any transaction is rolled
+        back before the connection is returned, so nothing is changed by EXPLAIN ANALYZE.
+        When all of its connections are in use, waits up to pool_timeout seconds for
+        one to be returned.
+
+        Raises:
+            psycopg2.pool.PoolError: No connection was returned in time.
+
+        Yields:
+            connection: Connection to the target.
+        """
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            raise PoolError(
+                f"all {self.max_connections} connections to target {self.name} "
+                f"were in use for {self.pool_timeout:g} seconds"
+            )
+        try:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadedConnectionPool(
+                        self.min_connections,
+                        self.max_connections,
+                        **self.connection_kwargs,
+                    )
+            conn = self.pool.getconn()
+            try:
+                yield conn
+            finally:
+                # A connection dropped by the server may only fail on rollback, in which
+                # case it is discarded instead of being returned to the pool
+                close = bool(conn.closed)
+                if not close:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        close = True
+                self.pool.putconn(conn, close=close)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Closes every connection in the pool of the target."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def explain(self, query: str, analyze: bool = False) -> dict:
+        """Retrieves the execution plan of a statement from the target.
+
+        Args:
+            query (str): Query string that was entered by the user.
+            analyze (bool, optional): Whether to execute the query with EXPLAIN ANALYZE.
+            Defaults to False.
+
+        Returns:
+            dict: Name and server version of the target, and either the QEP or the
+            error encountered.
+        """
+        result = {"name": self.name, "server_version": None, "plan": None, "error": ""}
+        try:
+            with self.connection() as conn:
+                result["server_version"] = conn.server_version
+                with conn.cursor() as cursor:
+                    result["plan"] = fetch_query_plan(cursor, query, analyze)
+        except Exception as error:
+            print(f"Exception encountered on target {self.name}: {error}")
+            result["error"] = str(error)
+        return result
+
+
+def load_targets() -> dict:
+    """Creates the targets listed in POSTGRES_TARGETS, separated by commas.
+    The first target is the default target used by QueryProcessor.
+
+    Returns:
+        dict: Targets keyed by name.
+    """
+    names = os.getenv("POSTGRES_TARGETS", "default").split(",")
+    return {name.strip(): Target(name.strip()) for name in names if name.strip()}
+
+
 class QueryProcessor:
     def __init__(self):
-        self.conn = self.start_db_connection()
-        self.cursor = self.conn.cursor()
+        self.targets = load_targets()
+        self.default_target = next(iter(self.targets.values()))
 
     def start_db_connection(self):
-        """Establishes connection with PostgreSQL database.
+        """Establishes a dedicated connection with the default target, outside of its
+        pool, for long-lived users such as the activity sampler.
 
         Returns:
             connection: Connection to the database.
         """
-        return connect(
-            dbname=os.getenv("POSTGRES_DBNAME"),
-            user=os.getenv("POSTGRES_USERNAME"),
-            password=os.getenv("POSTGRES_PASSWORD"),
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-        )
+        return connect(**self.default_target.connection_kwargs)
 
     def wrap_single_transaction(func):
-        """Decorator to create cursor each time the function is called.
+        """Decorator to borrow a connection from the pool of the default target each time
+        the function is called, and pass a new cursor on it to the function.
+        Errors of the function are swallowed, but a PoolError is raised so that the
+        caller can tell a busy database apart from an invalid query.
 
         Args:
             func (function): Function to be wrapped
@@ -60,49 +308,119 @@ class QueryProcessor:
         @wraps(func)
         def inner_func(self, *args, **kwargs):
             try:
-                self.cursor = self.conn.cursor()
-                ans = func(self, *args, **kwargs)
-                self.conn.commit()
-                return ans
+                with self.default_target.connection() as conn:
+                    with conn.cursor() as cursor:
+                        ans = func(self, cursor, *args, **kwargs)
+                    conn.commit()
+                    return ans
+            except PoolError:
+                raise
             except Exception as error:
                 print(f"Exception encountered, rolling back: {error}")
-                self.conn.rollback()
 
         return inner_func
 
     def stop_db_connection(self):
-        self.conn.close()
-        self.cursor.close()
+        for target in self.targets.values():
+            target.close()
 
-    @wrap_single_transaction
-    def explain(self, query: str) -> QueryPlan:
-        """Retrives execution plan of statement from PostgreSQL
+    def explain(self, query: str, analyze: bool = False) -> dict:
+        """Retrives execution plan of statement from PostgreSQL, using the pool of the
+        default target. The transaction is rolled back, so EXPLAIN ANALYZE does not
+        apply a statement which query_valid has already executed and committed.
+
+        Args:
+            query (str): Query string that was entered by the user.
+            analyze (bool, optional): Whether to execute the query with EXPLAIN ANALYZE,
+            which adds the actual rows, time and memory of each node and parallel worker.
+            Defaults to False.
+
+        Returns:
+            dict: Result of Target.explain, with either the QueryPlan consisting of all
+            the necessary information in the QEP to be displayed to the user, or the
+            error encountered.
+        """
+        return self.default_target.explain(query, analyze)
+
+    def explain_prepared(self, query: str, parameter_sets: list) -> PreparedQueryPlans:
+        """Retrieves the generic plan and the custom plans of a prepared statement from
+        PostgreSQL, by forcing plan_cache_mode for each EXPLAIN EXECUTE.
+        Unlike the other methods, errors are raised rather than swallowed, so that the
+        user sees why PREPARE or EXECUTE failed.
+
+        Args:
+            query (str): Query string with $1, $2, ... placeholders entered by the user.
+            parameter_sets (list): Parameter sets returned by parse_parameter_sets.
+
+        Raises:
+            psycopg2.Error: PREPARE or EXECUTE failed.
+
+        Returns:
+            PreparedQueryPlans: An object comparing the generic plan with the custom
+            plan of each parameter set.
+        """
+        with self.default_target.connection() as conn:
+            with conn.cursor() as cursor:
+                settings = fetch_settings(cursor, SETTINGS)
+
+                # Prepared statements outlive transactions, so remove the ones left behind by a failed request
+                cursor.execute("DEALLOCATE ALL")
+                cursor.execute("PREPARE qep_statement AS " + query)
+
+                def explain_execute(parameters, plan_cache_mode):
+                    cursor.execute("SET LOCAL plan_cache_mode = %s", (plan_cache_mode,))
+                    cursor.execute(
+                        sql.SQL("EXPLAIN (FORMAT JSON) EXECUTE qep_statement ({})").format(
+                            sql.SQL(", ").join(map(sql.Literal, parameters))
+                        )
+                    )
+                    plan = cursor.fetchall()
+                    return QueryPlan(plan[0][0][0]["Plan"], settings)
+
+                # The generic plan does not depend on the parameter values
+                generic_plan = explain_execute(parameter_sets[0], "force_generic_plan")
+                custom_plans = [
+                    (parameters, explain_execute(parameters, "force_custom_plan"))
+                    for parameters in parameter_sets
+                ]
+                cursor.execute("DEALLOCATE qep_statement")
+                return PreparedQueryPlans(generic_plan, custom_plans)
+
+    def explain_targets(self, query: str, analyze: bool = False) -> TargetComparison:
+        """Retrieves the execution plan of a statement from every target concurrently,
+        each using a connection from its own pool.
 
         Args:
             query (str): Query string that was entered by the user.
+            analyze (bool, optional): Whether to execute the query with EXPLAIN ANALYZE.
+            Defaults to False.
 
         Returns:
-            QueryPlan: An object consisting of all the necessary information in the QEP
-            to be displayed to the user.
+            TargetComparison: An object comparing the QEPs of the targets.
         """
-        self.cursor.execute("EXPLAIN (FORMAT JSON) " + query)
-        plan = self.cursor.fetchall()
-        query_plan_dict: dict = plan[0][0][0]["Plan"]
-        return QueryPlan(query_plan_dict)
+        with ThreadPoolExecutor(max_workers=len(self.targets)) as executor:
+            results = list(
+                executor.map(
+                    lambda target: target.explain(query, analyze),
+                    self.targets.values(),
+                )
+            )
+        return TargetComparison(results)
 
     @wrap_single_transaction
-    def query_valid(self, query: str):
+    def query_valid(self, cursor, query: str):
         """Validate query by trying to fetch a single row from the result set.
 
         Args:
+            cursor (cursor): Cursor passed by wrap_single_transaction.
             query (str): Query string
 
         Returns:
             bool: Whether the query is valid.
         """
-        self.cursor.execute(query)
+        cursor.execute(query)
         try:
-            self.cursor.fetchone()
+            cursor.fetchone()
         except:
             return False
         return True
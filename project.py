@@ -1,15 +1,28 @@
-from flask import Flask, redirect, render_template, request, url_for
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+
+from psycopg2 import Error as DatabaseError
 
 import config.base
 from preprocessing import *
 from annotation import *
+from monitoring import *
+from explorer import *
 
 app = Flask(__name__)
 
 # GET endpoint for '/'
 @app.route("/", methods=["GET"])
 def home():
-    return render_template("index.html")
+    return render_template("index.html", targets=list(query_processor.targets))
 
 
 # GET and POST endpoint for '/result'
@@ -19,6 +32,16 @@ def explain():
         return redirect("/")
 
     query = request.form["queryText"]
+    analyze = "analyze" in request.form
+    compare_targets = "compareTargets" in request.form
+    parameter_text = request.form.get("parameterSets", "")
+    parameter_sets = parse_parameter_sets(parameter_text)
+
+    if parameter_sets:
+        return render_prepared(
+            query, parameter_text, parameter_sets, analyze, compare_targets
+        )
+
     output = validate(query)
 
     if output["error"]:
@@ -29,25 +52,136 @@ def explain():
 
         html_context = {
             "query": error,
+            "analyze": analyze,
+            "compare_targets": compare_targets,
+            "targets": list(query_processor.targets),
+            "explanation_1": [error],
+        }
+
+        return render_template("index.html", **html_context)
+
+    comparison = None
+    if compare_targets:
+        comparison = query_processor.explain_targets(output["query"], analyze)
+
+        # The first target is the default one, so its result is reused rather than explained again
+        result = comparison.results[0]
+    else:
+        result = query_processor.explain(output["query"], analyze)
+    plan = result["plan"]
+
+    if plan is None:
+        error = f"Query could not be explained: {result['error']}"
+        html_context = {
+            "query": error,
+            "analyze": analyze,
+            "compare_targets": compare_targets,
+            "targets": list(query_processor.targets),
+            "explanation_1": [error],
+        }
+
+        return render_template("index.html", **html_context)
+
+    html_context = {
+        "query": query,
+        "analyze": analyze,
+        "compare_targets": compare_targets,
+        "targets": list(query_processor.targets),
+        "target_comparisons": comparison.comparisons if comparison else [],
+        "target_explanation": comparison.explanation if comparison else [],
+        "plan_id": plan_store.add(plan),
+        "total_nodes": len(plan.nodes),
+        "graph": plan.save_graph_file() if is_small_plan(plan) else None,
+        "explanation": plan.explanation if is_small_plan(plan) else None,
+        "total_cost": int(plan.total_cost),
+        "total_plan_rows": int(plan.plan_rows),
+        "total_seq_scan": int(plan.num_seq_scan_nodes),
+        "total_index_scan": int(plan.num_index_scan_nodes),
+        "total_parallel_seq_scan": int(plan.num_parallel_seq_scan_nodes),
+        "total_workers_planned": int(plan.workers_planned),
+        "total_workers_launched": int(plan.workers_launched),
+        "parallel_recommendations": page_items(plan.parallel_recommendations),
+        "peak_memory": formatKilobytes(plan.peak_memory_kb),
+        "total_spilled": int(plan.num_spilled_nodes),
+        "required_work_mem": formatKilobytes(plan.required_work_mem_kb),
+        "memory_diagnostics": page_items(plan.memory_diagnostics),
+    }
+
+    return render_template("index.html", **html_context)
+
+
+def render_prepared(query, parameter_text, parameter_sets, analyze, compare_targets):
+    output = validate_prepared(query, parameter_sets, analyze, compare_targets)
+
+    plans = None
+    if not output["error"]:
+        try:
+            plans = query_processor.explain_prepared(query, parameter_sets)
+        except DatabaseError as error:
+            output["error"] = True
+            output["error_message"] = f"Query is invalid: {error.pgerror or error}"
+
+    if output["error"]:
+        error = output["error_message"]
+        html_context = {
+            "query": error,
+            "analyze": analyze,
+            "compare_targets": compare_targets,
+            "targets": list(query_processor.targets),
+            "parameter_sets": parameter_text,
             "explanation_1": [error],
         }
 
         return render_template("index.html", **html_context)
 
-    plan = query_processor.explain(output["query"])
+    plan = plans.generic_plan
 
     html_context = {
         "query": query,
-        "graph": plan.save_graph_file(),
-        "explanation": plan.explanation,
+        "targets": list(query_processor.targets),
+        "parameter_sets": parameter_text,
+        "plan_id": plan_store.add(plan),
+        "total_nodes": len(plan.nodes),
+        "graph": plan.save_graph_file() if is_small_plan(plan) else None,
+        "explanation": plan.explanation if is_small_plan(plan) else None,
         "total_cost": int(plan.total_cost),
         "total_plan_rows": int(plan.plan_rows),
         "total_seq_scan": int(plan.num_seq_scan_nodes),
         "total_index_scan": int(plan.num_index_scan_nodes),
+        "total_parallel_seq_scan": int(plan.num_parallel_seq_scan_nodes),
+        "total_workers_planned": int(plan.workers_planned),
+        "parallel_recommendations": page_items(plan.parallel_recommendations),
+        "prepared_comparisons": plans.comparisons,
+        "prepared_explanation": plans.explanation,
     }
 
     return render_template("index.html", **html_context)
 
 
+# GET endpoint for '/plan/<plan_id>/nodes/<node_id>'
+@app.route("/plan/<plan_id>/nodes/<int:node_id>", methods=["GET"])
+def plan_subtree(plan_id, node_id):
+    plan = plan_store.get(plan_id)
+
+    if plan is None or node_id >= len(plan.nodes):
+        return jsonify({"error": "Plan or node not found."}), 404
+
+    return jsonify(subtree_response(plan, plan.nodes[node_id]))
+
+
+# GET endpoint for '/monitor/stream'
+@app.route("/monitor/stream", methods=["GET"])
+def monitor_stream():
+    activity_sampler.start()
+
+    return Response(
+        stream_with_context(
+            activity_sampler.stream(request.headers.get("Last-Event-ID"))
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,95 @@
+// Collapsible plan explorer, which fetches the child nodes of a node from
+// '/plan/<plan_id>/nodes/<node_id>' only when the node is expanded.
+(function () {
+  const explorer = document.getElementById("planExplorer");
+  if (!explorer) {
+    return;
+  }
+  const planId = explorer.dataset.planId;
+
+  function fetchSubtree(nodeId) {
+    return fetch(`/plan/${planId}/nodes/${nodeId}`).then((response) => {
+      if (!response.ok) {
+        throw new Error("The plan has expired, please submit the query again.");
+      }
+      return response.json();
+    });
+  }
+
+  function formatNumber(value) {
+    return Math.round(value).toLocaleString();
+  }
+
+  function formatRollup(node) {
+    const nodeTypes = Object.entries(node.rollup.node_types)
+      .map(([nodeType, count]) => `${count} × ${nodeType}`)
+      .join(", ");
+    return (
+      `self cost ${formatNumber(node.self_cost)}, ` +
+      `subtree cost ${formatNumber(node.rollup.cost)}, ` +
+      `rows ${formatNumber(node.rollup.rows)}, ` +
+      `${node.rollup.num_nodes} nodes (${nodeTypes})`
+    );
+  }
+
+  // The child nodes are only fetched on the first expansion, unless they are
+  // already known, e.g. for the root node
+  function createNode(node, knownChildren) {
+    const item = document.createElement("li");
+    const toggle = document.createElement("button");
+    toggle.className = "btn btn-sm btn-outline-light";
+    toggle.textContent = "+";
+
+    const title = document.createElement("b");
+    title.textContent = node.relation_name
+      ? `${node.node_type} on ${node.relation_name}`
+      : node.node_type;
+
+    const rollup = document.createElement("div");
+    rollup.className = "rollup";
+    rollup.textContent = formatRollup(node);
+
+    // The explanation and diagnostics are generated by annotation.py and interface.py,
+    // and contain formatting tags
+    const explanation = document.createElement("div");
+    explanation.innerHTML =
+      node.explanation +
+      node.diagnostics.map((diagnostic) => `<br />${diagnostic}`).join("");
+    explanation.hidden = true;
+
+    const children = document.createElement("ul");
+    children.hidden = true;
+
+    let loaded = Boolean(knownChildren);
+    if (knownChildren) {
+      knownChildren.forEach((child) => children.appendChild(createNode(child)));
+    }
+    toggle.addEventListener("click", () => {
+      const expanded = !children.hidden;
+      children.hidden = expanded;
+      explanation.hidden = expanded;
+      toggle.textContent = expanded ? "+" : "−";
+      if (!expanded && !loaded && node.num_children) {
+        loaded = true;
+        children.textContent = "";
+        fetchSubtree(node.id)
+          .then((subtree) => {
+            subtree.children.forEach((child) => children.appendChild(createNode(child)));
+          })
+          .catch((error) => {
+            loaded = false;
+            children.textContent = error.message;
+          });
+      }
+    });
+
+    item.append(toggle, title, rollup, explanation, children);
+    return item;
+  }
+
+  fetchSubtree(0)
+    .then((subtree) => explorer.appendChild(createNode(subtree.node, subtree.children)))
+    .catch((error) => {
+      explorer.textContent = error.message;
+    });
+})();
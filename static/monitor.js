@@ -0,0 +1,83 @@
+// Renders the live database activity streamed from '/monitor/stream'.
+// A "snapshot" event replaces the current state, "delta" events are applied on top of it.
+(function () {
+  const state = { activity: {}, locks: {}, io: {} };
+
+  function escapeHtml(value) {
+    return String(value === null || value === undefined ? "" : value)
+      .replace(/&/g, "&amp;")
+      .replace(/</g, "&lt;")
+      .replace(/>/g, "&gt;");
+  }
+
+  function applyRows(rows, delta) {
+    delta.added.concat(delta.changed).forEach((row) => {
+      rows[row.key] = row;
+    });
+    delta.removed.forEach((key) => {
+      delete rows[key];
+    });
+  }
+
+  function renderTable(id, rows, columns) {
+    const body = document.querySelector(`#${id} tbody`);
+    body.innerHTML = rows
+      .map(
+        (row) =>
+          "<tr>" +
+          columns.map((column) => `<td>${escapeHtml(row[column])}</td>`).join("") +
+          "</tr>"
+      )
+      .join("");
+  }
+
+  function render(timestamp) {
+    renderTable("monitorActivity", Object.values(state.activity), [
+      "pid",
+      "usename",
+      "state",
+      "wait_event_type",
+      "wait_event",
+      "query_seconds",
+      "query",
+    ]);
+    renderTable("monitorLocks", Object.values(state.locks), [
+      "pid",
+      "locktype",
+      "mode",
+      "relation",
+      "blocked_by",
+    ]);
+    renderTable(
+      "monitorIo",
+      Object.entries(state.io).map(([name, counters]) => ({
+        name: name,
+        counters: JSON.stringify(counters),
+      })),
+      ["name", "counters"]
+    );
+    document.getElementById("monitorUpdated").textContent = new Date(
+      timestamp * 1000
+    ).toLocaleTimeString();
+  }
+
+  const source = new EventSource("/monitor/stream");
+
+  source.addEventListener("snapshot", (event) => {
+    const snapshot = JSON.parse(event.data);
+    state.activity = {};
+    state.locks = {};
+    snapshot.activity.forEach((row) => (state.activity[row.key] = row));
+    snapshot.locks.forEach((row) => (state.locks[row.key] = row));
+    state.io = snapshot.io;
+    render(snapshot.timestamp);
+  });
+
+  source.addEventListener("delta", (event) => {
+    const delta = JSON.parse(event.data);
+    applyRows(state.activity, delta.activity);
+    applyRows(state.locks, delta.locks);
+    state.io = delta.io;
+    render(delta.timestamp);
+  });
+})();
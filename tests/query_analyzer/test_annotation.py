@@ -0,0 +1,122 @@
+import unittest
+
+from annotation import (
+    gatherAnnotation,
+    memoryAnnotation,
+    memoryUsage,
+    sequentialScanAnnotation,
+    workerSkew,
+    workerStats,
+)
+
+
+class TestParallelAnnotation(unittest.TestCase):
+    def setUp(self):
+        self.gather_json = {
+            "Node Type": "Gather",
+            "Workers Planned": 2,
+            "Workers Launched": 1,
+        }
+        self.parallel_seq_scan_json = {
+            "Node Type": "Seq Scan",
+            "Parallel Aware": True,
+            "Relation Name": "lineitem",
+            "Alias": "lineitem",
+            "Actual Rows": 100,
+            "Actual Loops": 3,
+            "Workers": [
+                {
+                    "Worker Number": 0,
+                    "Actual Total Time": 10.0,
+                    "Actual Rows": 200,
+                    "Actual Loops": 1,
+                },
+                {
+                    "Worker Number": 1,
+                    "Actual Total Time": 2.0,
+                    "Actual Rows": 40,
+                    "Actual Loops": 1,
+                },
+            ],
+        }
+
+    def test_gather_workers_launched(self):
+        annotation = gatherAnnotation(self.gather_json)
+        self.assertIn("<b>2</b> planned worker(s)", annotation)
+        self.assertIn("<b>1</b> were launched", annotation)
+        self.assertIn("Fewer workers were launched than planned", annotation)
+
+    def test_parallel_seq_scan_name(self):
+        annotation = sequentialScanAnnotation(self.parallel_seq_scan_json)
+        self.assertIn("<em>Parallel Seq Scan</em>", annotation)
+
+    def test_worker_stats_include_leader(self):
+        workers = workerStats(self.parallel_seq_scan_json)
+        self.assertEqual(
+            [worker["rows"] for worker in workers], [200, 40, 60]
+        )
+        self.assertEqual(workers[-1]["name"], "leader")
+
+    def test_worker_skew(self):
+        workers = workerStats(self.parallel_seq_scan_json)
+        self.assertAlmostEqual(workerSkew(workers), 2.0)
+        self.assertEqual(workerSkew([]), 1.0)
+
+
+class TestMemoryAnnotation(unittest.TestCase):
+    def test_sort_in_memory(self):
+        usage = memoryUsage(
+            {
+                "Node Type": "Sort",
+                "Sort Method": "quicksort",
+                "Sort Space Used": 100,
+                "Sort Space Type": "Memory",
+            }
+        )
+        self.assertFalse(usage["spilled"])
+        self.assertEqual(usage["work_mem_kb"], 100)
+
+    def test_sort_spilled(self):
+        query_plan = {
+            "Node Type": "Sort",
+            "Sort Method": "external merge",
+            "Sort Space Used": 2048,
+            "Sort Space Type": "Disk",
+        }
+        usage = memoryUsage(query_plan)
+        self.assertTrue(usage["spilled"])
+        self.assertEqual(usage["disk_kb"], 2048)
+        self.assertEqual(usage["work_mem_kb"], 4096)
+        annotation = memoryAnnotation(query_plan)
+        self.assertIn("<b>4.0 MB</b>", annotation)
+        self.assertIn("estimated", annotation)
+
+    def test_sort_spilled_uses_work_mem(self):
+        query_plan = {
+            "Node Type": "Sort",
+            "Sort Method": "external merge",
+            "Sort Space Used": 2048,
+            "Sort Space Type": "Disk",
+        }
+        usage = memoryUsage(query_plan, work_mem_kb=1024)
+        self.assertEqual(usage["memory_kb"], 1024)
+        self.assertIn(
+            "after using <b>1.0 MB</b> of memory",
+            memoryAnnotation(query_plan, work_mem_kb=1024),
+        )
+
+    def test_hash_batches(self):
+        usage = memoryUsage(
+            {
+                "Node Type": "Hash",
+                "Hash Batches": 4,
+                "Peak Memory Usage": 1000,
+            },
+            hash_mem_multiplier=2.0,
+        )
+        self.assertTrue(usage["spilled"])
+        self.assertEqual(usage["work_mem_kb"], 2000)
+
+    def test_no_memory_information(self):
+        self.assertIsNone(memoryUsage({"Node Type": "Seq Scan"}))
+        self.assertEqual(memoryAnnotation({"Node Type": "Seq Scan"}), "")
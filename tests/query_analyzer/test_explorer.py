@@ -0,0 +1,119 @@
+import unittest
+
+from explorer import PlanStore, page_items, plan_store, subtree_response
+from interface import QueryPlan
+from project import app
+
+
+class TestPlanStore(unittest.TestCase):
+    def setUp(self):
+        self.plan_store = PlanStore(2)
+
+    def test_get_plan(self):
+        plan_id = self.plan_store.add("plan")
+        self.assertEqual(self.plan_store.get(plan_id), "plan")
+        self.assertIsNone(self.plan_store.get("unknown"))
+
+    def test_evict_least_recently_used(self):
+        first_id = self.plan_store.add("first")
+        second_id = self.plan_store.add("second")
+        self.plan_store.get(first_id)
+        self.plan_store.add("third")
+        self.assertEqual(self.plan_store.get(first_id), "first")
+        self.assertIsNone(self.plan_store.get(second_id))
+
+
+class TestPlanExplorer(unittest.TestCase):
+    def setUp(self):
+        # The Sort of the InitPlan is more expensive than its parent, so the self
+        # cost of the parent is clamped at 0
+        self.qep = QueryPlan(
+            {
+                "Node Type": "Limit",
+                "Total Cost": 100,
+                "Plan Rows": 10,
+                "Plans": [
+                    {
+                        "Node Type": "Sort",
+                        "Total Cost": 120,
+                        "Plan Rows": 100,
+                        "Sort Key": ["o_orderdate"],
+                        "Plans": [
+                            {
+                                "Node Type": "Seq Scan",
+                                "Total Cost": 70,
+                                "Plan Rows": 100,
+                                "Relation Name": "orders",
+                            }
+                        ],
+                    },
+                    {
+                        "Node Type": "Seq Scan",
+                        "Total Cost": 5,
+                        "Plan Rows": 1,
+                        "Relation Name": "region",
+                    },
+                ],
+            }
+        )
+
+    def test_depth_first_node_ids(self):
+        self.assertEqual(
+            [(node.node_id, node.node_type) for node in self.qep.nodes],
+            [(0, "Limit"), (1, "Sort"), (2, "Seq Scan"), (3, "Seq Scan")],
+        )
+        self.assertIs(self.qep.nodes[0], self.qep.root)
+
+    def test_rollups(self):
+        root, sort, scan, _ = self.qep.nodes
+        self.assertEqual(root.self_cost, 0)
+        self.assertEqual(sort.self_cost, 50)
+        self.assertEqual(scan.self_cost, 70)
+        self.assertEqual(sort.subtree_cost, 120)
+        self.assertEqual(root.subtree_cost, 125)
+        self.assertEqual(root.subtree_rows, 211)
+        self.assertEqual(root.subtree_num_nodes, 4)
+        self.assertEqual(
+            root.subtree_node_types, {"Limit": 1, "Sort": 1, "Seq Scan": 2}
+        )
+
+    def test_subtree_response(self):
+        response = subtree_response(self.qep, self.qep.nodes[1])
+        self.assertEqual(response["node"]["id"], 1)
+        self.assertEqual(response["node"]["num_children"], 1)
+        self.assertEqual([child["id"] for child in response["children"]], [2])
+        self.assertEqual(response["children"][0]["num_children"], 0)
+        self.assertEqual(response["children"][0]["relation_name"], "orders")
+
+        response = subtree_response(self.qep, self.qep.root)
+        self.assertEqual(response["node"]["num_children"], 2)
+        self.assertEqual(response["node"]["rollup"]["num_nodes"], 4)
+
+    def test_page_items(self):
+        items = [str(i) for i in range(15)]
+        self.assertEqual(page_items(items[:3]), items[:3])
+        capped = page_items(items)
+        self.assertEqual(len(capped), 11)
+        self.assertIn("5 more", capped[-1])
+
+
+class TestPlanExplorerEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.plan_id = plan_store.add(
+            QueryPlan({"Node Type": "Result", "Total Cost": 1, "Plan Rows": 1})
+        )
+
+    def test_node(self):
+        response = self.client.get(f"/plan/{self.plan_id}/nodes/0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["node"]["node_type"], "Result")
+
+    def test_unknown_node(self):
+        response = self.client.get(f"/plan/{self.plan_id}/nodes/1")
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_plan(self):
+        response = self.client.get("/plan/unknown/nodes/0")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", response.get_json())
@@ -0,0 +1,255 @@
+import unittest
+
+from explorer import FULL_PLAN_MAX_NODES
+from interface import (
+    PreparedQueryPlans,
+    QueryPlan,
+    TargetComparison,
+    format_operator_tree,
+    format_server_version,
+)
+
+
+def plan_node(node_type, total_cost, plan_rows=1, plans=None, **attributes):
+    query_plan = {
+        "Node Type": node_type,
+        "Total Cost": total_cost,
+        "Plan Rows": plan_rows,
+        "Plans": plans or [],
+    }
+    query_plan.update(attributes)
+    return query_plan
+
+
+class TestParallelRecommendations(unittest.TestCase):
+    def setUp(self):
+        self.parallel_aware_json = plan_node(
+            "Gather",
+            100,
+            plans=[
+                plan_node(
+                    "Seq Scan",
+                    90,
+                    **{"Relation Name": "lineitem", "Parallel Aware": True},
+                )
+            ],
+            **{"Workers Planned": 2},
+        )
+        self.repeated_scan_json = plan_node(
+            "Gather",
+            300,
+            plans=[
+                plan_node(
+                    "Hash Join",
+                    280,
+                    plans=[
+                        plan_node(
+                            "Seq Scan",
+                            100,
+                            **{"Relation Name": "nation", "Parallel Aware": True},
+                        ),
+                        plan_node(
+                            "Hash",
+                            150,
+                            plans=[
+                                plan_node(
+                                    "Seq Scan",
+                                    150,
+                                    **{
+                                        "Relation Name": "orders",
+                                        "Parallel Aware": False,
+                                    },
+                                )
+                            ],
+                        ),
+                    ],
+                    **{"Join Type": "Inner"},
+                )
+            ],
+            **{"Workers Planned": 2},
+        )
+
+    def test_parallel_aware_scan(self):
+        qep = QueryPlan(self.parallel_aware_json)
+        self.assertEqual(qep.num_parallel_seq_scan_nodes, 1)
+        self.assertEqual(qep.parallel_recommendations, [])
+
+    def test_scan_repeated_by_every_worker(self):
+        qep = QueryPlan(self.repeated_scan_json)
+        self.assertEqual(len(qep.parallel_recommendations), 1)
+        self.assertIn("<b>orders</b>", qep.parallel_recommendations[0])
+        self.assertIn("every worker repeats", qep.parallel_recommendations[0])
+        self.assertIn("Parallel Hash Join", qep.parallel_recommendations[0])
+        self.assertNotIn(
+            "max_parallel_workers_per_gather", qep.parallel_recommendations[0]
+        )
+
+    def test_repeated_scan_with_parallel_hash_disabled(self):
+        qep = QueryPlan(self.repeated_scan_json, {"enable_parallel_hash": "off"})
+        self.assertIn(
+            "SET enable_parallel_hash = on", qep.parallel_recommendations[0]
+        )
+
+    def test_size_setting(self):
+        qep = QueryPlan(
+            self.parallel_aware_json, {"min_parallel_table_scan_size": "8192"}
+        )
+        self.assertIn(
+            "(currently 8.0 MB)", qep.setting("min_parallel_table_scan_size")
+        )
+
+
+class TestMemoryDiagnostics(unittest.TestCase):
+    def setUp(self):
+        self.spilled_sort_json = plan_node(
+            "Sort",
+            100,
+            plans=[plan_node("Seq Scan", 50, **{"Relation Name": "lineitem"})],
+            **{
+                "Sort Key": ["l_returnflag"],
+                "Sort Space Used": 8192,
+                "Sort Space Type": "Disk",
+            },
+        )
+
+    def test_peak_memory_of_spilled_sort(self):
+        qep = QueryPlan(self.spilled_sort_json, {"work_mem": "4096"})
+        self.assertEqual(qep.peak_memory_kb, 4096)
+        self.assertEqual(qep.num_spilled_nodes, 1)
+        self.assertEqual(qep.required_work_mem_kb, 16384)
+
+
+class TestTargetComparison(unittest.TestCase):
+    def setUp(self):
+        self.scan_plan = QueryPlan(
+            plan_node("Seq Scan", 100, **{"Relation Name": "orders"})
+        )
+        self.join_plan = QueryPlan(
+            plan_node(
+                "Hash Join",
+                300,
+                plans=[
+                    plan_node("Seq Scan", 100, **{"Relation Name": "orders"}),
+                    plan_node(
+                        "Hash",
+                        50,
+                        plans=[
+                            plan_node(
+                                "Seq Scan", 50, **{"Relation Name": "customer"}
+                            )
+                        ],
+                    ),
+                ],
+                **{"Join Type": "Inner"},
+            )
+        )
+
+    def result(self, name, plan=None, error="", server_version=160002):
+        return {
+            "name": name,
+            "server_version": server_version,
+            "plan": plan,
+            "error": error,
+        }
+
+    def test_failed_baseline(self):
+        comparison = TargetComparison(
+            [
+                self.result("default", error="connection refused"),
+                self.result("pg15", self.scan_plan, server_version=150004),
+                self.result("pg16", self.join_plan),
+            ]
+        )
+        self.assertEqual(comparison.baseline["name"], "pg15")
+        self.assertEqual(comparison.comparisons[0]["error"], "connection refused")
+        self.assertTrue(comparison.comparisons[1]["same_plan"])
+        self.assertFalse(comparison.comparisons[2]["same_plan"])
+        self.assertEqual(comparison.comparisons[2]["ratio"], 3.0)
+        self.assertEqual(len(comparison.explanation), 2)
+        self.assertIn("different operations", comparison.explanation[1])
+
+    def test_operator_tree_of_large_plan_not_shown(self):
+        large_plan = QueryPlan(
+            plan_node(
+                "Append",
+                100,
+                plans=[
+                    plan_node("Seq Scan", 1, **{"Relation Name": "orders"})
+                    for _ in range(FULL_PLAN_MAX_NODES)
+                ],
+            )
+        )
+        comparison = TargetComparison(
+            [
+                self.result("default", self.join_plan),
+                self.result("pg16", large_plan),
+            ]
+        )
+        self.assertEqual(
+            comparison.comparisons[0]["operator_tree"],
+            "Hash Join(Seq Scan, Hash(Seq Scan))",
+        )
+        self.assertIsNone(comparison.comparisons[1]["operator_tree"])
+        self.assertFalse(comparison.comparisons[1]["same_plan"])
+        self.assertEqual(
+            comparison.comparisons[1]["num_nodes"], FULL_PLAN_MAX_NODES + 1
+        )
+
+    def test_every_target_failed(self):
+        comparison = TargetComparison(
+            [self.result("default", error="down"), self.result("pg16", error="down")]
+        )
+        self.assertIsNone(comparison.baseline)
+        self.assertEqual(
+            comparison.explanation,
+            ["The query could not be explained on any target."],
+        )
+
+    def test_format_server_version(self):
+        self.assertEqual(format_server_version(90624), "9.6.24")
+        self.assertEqual(format_server_version(100023), "10.23")
+        self.assertEqual(format_server_version(160002), "16.2")
+        self.assertEqual(format_server_version(None), "unknown")
+
+    def test_format_operator_tree(self):
+        self.assertEqual(
+            format_operator_tree(self.join_plan.operator_tree()),
+            "Hash Join(Seq Scan, Hash(Seq Scan))",
+        )
+
+
+class TestPreparedQueryPlans(unittest.TestCase):
+    def setUp(self):
+        self.generic_plan = QueryPlan(
+            plan_node("Seq Scan", 1000, **{"Relation Name": "orders"})
+        )
+        self.index_plan = QueryPlan(
+            plan_node("Index Scan", 100, **{"Relation Name": "orders"})
+        )
+        self.scan_plan = QueryPlan(
+            plan_node("Seq Scan", 1100, **{"Relation Name": "orders"})
+        )
+
+    def test_generic_plan_much_worse(self):
+        plans = PreparedQueryPlans(
+            self.generic_plan,
+            [(["1"], self.index_plan), (["2"], self.scan_plan)],
+        )
+        first, second = plans.comparisons
+        self.assertEqual(first["ratio"], 10.0)
+        self.assertFalse(first["same_plan"])
+        self.assertTrue(second["same_plan"])
+        self.assertEqual(plans.min_custom_cost, 100)
+        self.assertEqual(plans.max_custom_cost, 1100)
+        self.assertEqual(plans.average_custom_cost, 600)
+
+        # The generic plan is more expensive than the average custom plan
+        self.assertIn("keep planning a custom plan", plans.explanation[1])
+        self.assertEqual(len(plans.explanation), 3)
+        self.assertIn("<b>10.0x</b>", plans.explanation[2])
+        self.assertIn("different operations", plans.explanation[2])
+
+    def test_switch_to_generic_plan(self):
+        plans = PreparedQueryPlans(self.generic_plan, [(["2"], self.scan_plan)])
+        self.assertIn("switch to the generic plan", plans.explanation[1])
+        self.assertEqual(len(plans.explanation), 2)
@@ -0,0 +1,108 @@
+import json
+import unittest
+
+from monitoring import ActivitySampler, diff_counters, diff_rows, format_event
+
+
+def parse_event(text):
+    fields = dict(line.split(": ", 1) for line in text.strip().split("\n"))
+    return fields["event"], fields["id"], json.loads(fields["data"])
+
+
+class TestDiff(unittest.TestCase):
+    def test_diff_rows(self):
+        previous = [
+            {"key": "1", "state": "active"},
+            {"key": "2", "state": "idle"},
+        ]
+        current = [
+            {"key": "2", "state": "active"},
+            {"key": "3", "state": "idle"},
+        ]
+        self.assertEqual(
+            diff_rows(previous, current),
+            {
+                "added": [{"key": "3", "state": "idle"}],
+                "changed": [{"key": "2", "state": "active"}],
+                "removed": ["1"],
+            },
+        )
+
+    def test_diff_counters(self):
+        previous = {"orders": {"reads": 10, "hits": 5}}
+        current = {
+            "orders": {"reads": 15, "hits": 5},
+            "lineitem": {"reads": 100, "hits": 0},
+            "region": {"reads": 0, "hits": 0},
+        }
+        self.assertEqual(
+            diff_counters(previous, current),
+            {"orders": {"reads": 5, "hits": 0}},
+        )
+
+    def test_format_event(self):
+        self.assertEqual(
+            format_event("delta", "abc-1", "{}"),
+            "event: delta\nid: abc-1\ndata: {}\n\n",
+        )
+
+
+class TestActivitySampler(unittest.TestCase):
+    def setUp(self):
+        self.sampler = ActivitySampler(None, interval=1, buffer_size=3)
+
+    def publish(self, pids, reads=0):
+        self.sampler.publish(
+            {
+                "timestamp": 0,
+                "activity": [{"key": str(pid), "pid": pid} for pid in pids],
+                "locks": [],
+                "io": {"orders": {"reads": reads}},
+            }
+        )
+
+    def test_new_viewer_receives_snapshot(self):
+        self.publish([1])
+        self.publish([1, 2])
+        event, event_id, data = parse_event(next(self.sampler.stream()))
+        self.assertEqual(event, "snapshot")
+        self.assertEqual(event_id, self.sampler.event_id(2))
+        self.assertEqual([row["pid"] for row in data["activity"]], [1, 2])
+
+    def test_resume_from_last_event_id(self):
+        self.publish([1])
+        self.publish([1, 2], reads=4)
+        self.publish([2], reads=6)
+        stream = self.sampler.stream(self.sampler.event_id(1))
+
+        event, event_id, data = parse_event(next(stream))
+        self.assertEqual((event, event_id), ("delta", self.sampler.event_id(2)))
+        self.assertEqual(data["activity"]["added"], [{"key": "2", "pid": 2}])
+        self.assertEqual(data["io"], {"orders": {"reads": 4}})
+
+        event, event_id, data = parse_event(next(stream))
+        self.assertEqual((event, event_id), ("delta", self.sampler.event_id(3)))
+        self.assertEqual(data["activity"]["removed"], ["1"])
+
+    def test_fallen_behind_ring_buffer(self):
+        for pid in range(5):
+            self.publish([pid])
+
+        # Samples 1 and 2 have been evicted, so the delta of sample 2 is missing
+        event, event_id, _ = parse_event(
+            next(self.sampler.stream(self.sampler.event_id(1)))
+        )
+        self.assertEqual((event, event_id), ("snapshot", self.sampler.event_id(5)))
+
+        # The delta of sample 3 is still in the buffer
+        event, event_id, _ = parse_event(
+            next(self.sampler.stream(self.sampler.event_id(2)))
+        )
+        self.assertEqual((event, event_id), ("delta", self.sampler.event_id(3)))
+
+    def test_event_id_of_previous_process(self):
+        self.publish([1])
+        self.publish([2])
+        for last_event_id in ("1", "previous-1", f"{self.sampler.boot_id}-x"):
+            event, _, _ = parse_event(next(self.sampler.stream(last_event_id)))
+            self.assertEqual(event, "snapshot")
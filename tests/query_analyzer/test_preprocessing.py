@@ -0,0 +1,145 @@
+import unittest
+from unittest import mock
+
+from psycopg2.pool import PoolError
+
+from preprocessing import (
+    Target,
+    fetch_settings,
+    parse_parameter_sets,
+    query_processor,
+    validate,
+    validate_prepared,
+)
+
+
+class DroppedConnection:
+    closed = 0
+
+    def rollback(self):
+        raise Exception("server closed the connection unexpectedly")
+
+
+class RecordingPool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = []
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+class SettingsCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, parameters):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestFetchSettings(unittest.TestCase):
+    def test_sizes_converted_to_kilobytes(self):
+        cursor = SettingsCursor(
+            [
+                ("min_parallel_table_scan_size", "1024", "8kB"),
+                ("work_mem", "4096", "kB"),
+                ("parallel_setup_cost", "1000", None),
+            ]
+        )
+        self.assertEqual(
+            fetch_settings(cursor, ()),
+            {
+                "min_parallel_table_scan_size": "8192",
+                "work_mem": "4096",
+                "parallel_setup_cost": "1000",
+            },
+        )
+
+
+class TestTarget(unittest.TestCase):
+    def setUp(self):
+        self.target = Target("default")
+        self.conn = DroppedConnection()
+        self.target.pool = RecordingPool(self.conn)
+
+    def test_connection_returned_when_rollback_fails(self):
+        with self.target.connection() as conn:
+            self.assertIs(conn, self.conn)
+        self.assertEqual(self.target.pool.returned, [(self.conn, True)])
+
+    def test_explain_reports_error(self):
+        result = self.target.explain("SELECT 1")
+        self.assertIsNone(result["plan"])
+        self.assertTrue(result["error"])
+        self.assertEqual(self.target.pool.returned, [(self.conn, True)])
+
+    def test_waits_for_free_connection(self):
+        self.target.pool_timeout = 0
+        for _ in range(self.target.max_connections):
+            self.target.slots.acquire()
+        with self.assertRaises(PoolError):
+            with self.target.connection():
+                pass
+        result = self.target.explain("SELECT 1")
+        self.assertIn("were in use", result["error"])
+        self.assertEqual(self.target.pool.returned, [])
+
+        # The slot is released again once the connection is returned
+        self.target.slots.release()
+        with self.target.connection() as conn:
+            self.assertIs(conn, self.conn)
+        with self.target.connection() as conn:
+            self.assertIs(conn, self.conn)
+
+    def test_busy_database_is_not_invalid_query(self):
+        with mock.patch.object(
+            query_processor, "query_valid", side_effect=PoolError("busy")
+        ):
+            output = validate("SELECT 1")
+        self.assertTrue(output["error"])
+        self.assertIn("database is busy", output["error_message"])
+
+
+class TestPreparedValidation(unittest.TestCase):
+    def setUp(self):
+        self.query = "SELECT * FROM orders WHERE o_orderdate < $1 AND o_totalprice > $2"
+
+    def test_parse_parameter_sets(self):
+        text = '1998-09-02, 90\n\n   \n"BUILDING, AUTOMOBILE", 5\n'
+        self.assertEqual(
+            parse_parameter_sets(text),
+            [["1998-09-02", "90"], ["BUILDING, AUTOMOBILE", "5"]],
+        )
+        self.assertEqual(parse_parameter_sets("\n  \n"), [])
+
+    def test_valid(self):
+        output = validate_prepared(self.query, [["1998-09-02", "90"]])
+        self.assertFalse(output["error"])
+
+    def test_number_of_values(self):
+        output = validate_prepared(self.query, [["1998-09-02"]])
+        self.assertTrue(output["error"])
+        self.assertIn("up to $2", output["error_message"])
+        self.assertIn("1 value(s)", output["error_message"])
+
+    def test_inconsistent_parameter_sets(self):
+        output = validate_prepared(self.query, [["1998-09-02", "90"], ["1"]])
+        self.assertTrue(output["error"])
+        self.assertIn("same number of values", output["error_message"])
+
+    def test_no_placeholders(self):
+        output = validate_prepared("SELECT 1", [["1"]])
+        self.assertTrue(output["error"])
+        self.assertIn("no $1", output["error_message"])
+
+    def test_unsupported_options(self):
+        for options in ({"analyze": True}, {"compare_targets": True}):
+            output = validate_prepared(self.query, [["1998-09-02", "90"]], **options)
+            self.assertTrue(output["error"])
+            self.assertIn("not supported", output["error_message"])